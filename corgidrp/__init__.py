@@ -39,6 +39,8 @@ def create_config_dir():
         config["PATH"]["default_calibs"] = default_cal_dir
         config["DATA"] = {}
         config["DATA"]["track_individual_errors"] = "False"
+        config["DATA"]["dark_combine_float32"] = "False"
+        config["DATA"]["pc_stack_float32"] = "False"
         config["WALKER"] = {}
         config["WALKER"]["skip_missing_cal_steps"] = "False"
         config["WALKER"]["jit_calib_id"] = "False"
@@ -64,5 +66,7 @@ config.read(config_filepath)
 caldb_filepath = config.get("PATH", "caldb", fallback=None) # path to calibration db
 default_cal_dir = config.get("PATH", "default_calibs", fallback=None) # path to default calibrations directory
 track_individual_errors = _bool_map[config.get("DATA", "track_individual_errors", fallback='false').lower()] # save each individual error component separately?
+dark_combine_float32 = _bool_map[config.get("DATA", "dark_combine_float32", fallback='false').lower()] # combine dark stacks in float32 instead of float64 to halve memory traffic?
+pc_stack_float32 = _bool_map[config.get("DATA", "pc_stack_float32", fallback='false').lower()] # threshold photon-counting stacks in float32 instead of float64 to halve memory traffic?
 skip_missing_cal_steps = _bool_map[config.get("WALKER", "skip_missing_cal_steps", fallback='false').lower()] # skip steps, instead of crashing, when suitable calibration file cannot be found 
 jit_calib_id = _bool_map[config.get("WALKER", "jit_calib_id", fallback='false').lower()] # AUTOMATIC calibration files identified right before the execution of a step, rather than when recipe is first generated
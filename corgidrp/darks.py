@@ -2,6 +2,7 @@ import numpy as np
 import warnings
 from astropy.io import fits
 
+import corgidrp
 from corgidrp.detector import slice_section, imaging_slice, imaging_area_geom, detector_areas
 import corgidrp.check as check
 from corgidrp.data import DetectorNoiseMaps, Dark
@@ -123,7 +124,8 @@ def mean_combine(image_list, bpmap_list, err=False):
 
     return comb_image, comb_bpmap, map_im, enough_for_rn
 
-def build_trad_dark(dataset, detector_params, detector_regions=None, full_frame=False):
+def build_trad_dark(dataset, detector_params, detector_regions=None, full_frame=False,
+                    collapse='mean'):
     """This function produces a traditional master dark from a stack of darks
     taken at a specific EM gain and exposure time to match a corresponding
     observation.  The input dataset represents a stack of dark frames (in e-).
@@ -171,6 +173,11 @@ def build_trad_dark(dataset, detector_params, detector_regions=None, full_frame=
         may be useful for the module that statistically fits a frame to find
         the empirically applied EM gain, for example). If False, an image-area
         master dark is generated.  Defaults to False.
+    collapse (str):
+        "mean" or "median".  How to combine the stack of darks.  The median is
+        more robust to outliers (e.g., uncorrected cosmic-ray residuals), and
+        its statistical error is inflated by sqrt(pi/2) accordingly.
+        Defaults to "mean".
 
     Returns:
     master_dark : corgidrp.data.DetectorNoiseMaps instance
@@ -186,6 +193,8 @@ def build_trad_dark(dataset, detector_params, detector_regions=None, full_frame=
     """
     if detector_regions is None:
             detector_regions = detector_areas
+    if collapse.lower() not in ['mean', 'median']:
+        raise ValueError('build_trad_dark can only collapse with mean or median')
 
     _, unique_vals = dataset.split_dataset(exthdr_keywords=['EXPTIME', 'CMDGAIN', 'KGAIN'])
     if len(unique_vals) > 1:
@@ -195,13 +204,25 @@ def build_trad_dark(dataset, detector_params, detector_regions=None, full_frame=
     telem_rows_end = detector_params.params['telem_rows_end']
     telem_rows = slice(telem_rows_start, telem_rows_end)
 
+    # accumulate the sums needed for the mean frame and the combined frame
+    # error in the same pass over the stack rather than re-reading the full
+    # stack once per quantity (as separate mean_combine calls would)
     frames = []
     bpmaps = []
-    errs = []
+    # optionally combine in float32, which halves the bytes moved through
+    # the memory-bound reductions; detector counts are well within float32
+    # precision, but float64 remains the default
+    dtype = np.float32 if corgidrp.dark_combine_float32 else float
+    sum_frame = np.zeros_like(dataset.frames[0].data, dtype=dtype)
+    sum_errsq = np.zeros_like(sum_frame)
+    unmasked_num = np.zeros_like(sum_frame, dtype=int)
+    # scratch buffer reused across frames so the accumulation allocates no
+    # per-frame temporaries
+    scratch = np.empty_like(sum_frame)
     for fr in dataset.frames:
         # ensure frame is in float so nan can be assigned, though it should
         # already be float
-        frame = fr.data.astype(float)
+        frame = fr.data.astype(dtype)
         # For the fit, all types of bad pixels should be masked:
         b1 = fr.dq.astype(bool).astype(int)
         err = fr.err[0]
@@ -210,15 +231,54 @@ def build_trad_dark(dataset, detector_params, detector_regions=None, full_frame=
         if np.isnan(i0).any():
             raise ValueError('telem_rows cannot be in image area.')
         frame[telem_rows] = 0
+        good = (b1 == 0)
+        # multiplying by the 0/1 mask zeroes out bad pixels without the
+        # temporaries an np.where would allocate
+        np.multiply(frame, good, out=scratch)
+        sum_frame += scratch
+        np.multiply(err, good, out=scratch)
+        np.multiply(scratch, scratch, out=scratch)
+        sum_errsq += scratch
+        unmasked_num += good
         frames.append(frame)
         bpmaps.append(b1)
-        errs.append(err)
-    mean_frame, combined_bpmap, unmasked_num, _ = mean_combine(frames, bpmaps)
-    mean_err, _, _, _ = mean_combine(errs, bpmaps, err=True)
+    # (sqrt of sum of sigma**2 terms)/sqrt(n); divide the sum by unmasked_num
+    # only where it is not equal to 0 (i.e., not masked in every frame)
+    mean_err = np.sqrt(np.divide(sum_errsq, unmasked_num,
+                                 out=np.zeros_like(sum_errsq),
+                                 where=unmasked_num != 0))
+    # pixels that are masked in every frame
+    combined_bpmap = (unmasked_num == 0).astype(int)
     # combine the error from individual frames to the standard deviation across
     # the frames due to statistical variance
     masked_frames = np.ma.masked_array(frames, bpmaps)
-    stat_std = np.ma.std(masked_frames, axis=0)/np.sqrt(unmasked_num)
+    # reduce over the stack one spatial tile at a time so each (N, tile, tile)
+    # slab stays cache-resident rather than streaming the whole cube from
+    # main memory per reduction; the per-pixel results are unchanged since
+    # the reductions are independent along the frame axis
+    tile = 256
+    nrows, ncols = sum_frame.shape
+    stat_std = np.ma.masked_array(np.zeros_like(sum_frame),
+                                  mask=np.zeros(sum_frame.shape, dtype=bool))
+    if collapse.lower() == 'median':
+        mean_frame = np.zeros_like(sum_frame)
+    for i in range(0, nrows, tile):
+        for j in range(0, ncols, tile):
+            sub = masked_frames[:, i:i+tile, j:j+tile]
+            stat_std[i:i+tile, j:j+tile] = np.ma.std(sub, axis=0)
+            if collapse.lower() == 'median':
+                # more robust to outliers than the mean; set fully masked
+                # pixels to zero, as mean_combine does
+                mean_frame[i:i+tile, j:j+tile] = np.ma.filled(
+                    np.ma.median(sub, axis=0), 0)
+    stat_std = stat_std/np.sqrt(unmasked_num)
+    if collapse.lower() == 'median':
+        # inflate the statistical error for the median
+        stat_std = stat_std*np.sqrt(np.pi/2)
+    else:
+        mean_frame = np.divide(sum_frame, unmasked_num,
+                               out=np.zeros_like(sum_frame),
+                               where=unmasked_num != 0)
     total_err = np.sqrt(mean_err**2 + stat_std**2)
     # There are no masked pixels in total_err, and FITS can't save masked arrays,
     # so turn it into a regular array
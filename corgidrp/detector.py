@@ -30,41 +30,43 @@ def create_flatfield(flat_dataset):
 
     combined_frame = np.nanmean(flat_dataset.all_data, axis=0)
 
-    flat_field = data.FlatField(combined_frame, pri_hdr=flat_dataset[0].pri_hdr.copy(),
-                         ext_hdr=flat_dataset[0].ext_hdr.copy(), input_dataset=flat_dataset)
+    # copy the headers through the C-level serializer, which is considerably
+    # faster than Header.copy()'s per-card loop; the Image constructor keeps
+    # a direct reference, so the copies are still needed
+    pri_hdr = fits.Header.fromstring(flat_dataset[0].pri_hdr.tostring())
+    ext_hdr = fits.Header.fromstring(flat_dataset[0].ext_hdr.tostring())
+    flat_field = data.FlatField(combined_frame, pri_hdr=pri_hdr,
+                         ext_hdr=ext_hdr, input_dataset=flat_dataset)
 
-    #determine the standard error of the mean: stddev/sqrt(n_frames)
-    flat_field.err = np.nanstd(flat_dataset.all_data, axis=0)/np.sqrt(len(flat_dataset))
-    flat_field.err=flat_field.err.reshape((1,)+flat_field.err.shape) # Get it into the right dimension
+    #determine the standard error of the mean: stddev/sqrt(n_frames),
+    #with keepdims=True putting it into the right (1, rows, cols) dimension
+    sqrt_n_frames = np.sqrt(len(flat_dataset))
+    flat_field.err = np.nanstd(flat_dataset.all_data, axis=0, keepdims=True)/sqrt_n_frames
 
 
     return flat_field
 
-def get_relgains(frame, em_gain, non_lin_correction):
+def _build_relgain_spline(non_lin_correction):
     """
-    For a given bias subtracted frame of dn counts, return a same sized
-    array of relative gain values.
+    Validate the non-linearity calibration table and construct the 2d linear
+    interpolation over (EM gain, dn count).
 
-    This algorithm contains two interpolations:
+    The spline only depends on the calibration file, so it is cached on the
+    calibration object and reused for every EM gain.
 
-    - A 2d interpolation to find the relative gain curve for a given EM gain
-    - A 1d interpolation to find a relative gain value for each given dn
-      count value.
-
-    Both of these interpolations are linear, and both use their edge values as
-    constant extrapolations for out of bounds values.
-
-    Parameters:
-        frame (array_like): Array of dn count values.
-        em_gain (float): Detector EM gain.
-        non_lin_correction (corgi.drp.NonLinearityCorrection): A NonLinearityCorrection calibration file.
+    Args:
+        non_lin_correction (corgidrp.data.NonLinearityCorrection): A NonLinearityCorrection calibration file.
 
     Returns:
-        array_like: Array of relative gain values.
+        tuple:
+            count_ax (np.array): dn count values of the calibration table
+            f (scipy.interpolate.RectBivariateSpline): 2d linear interpolation
+            over (EM gain, dn count)
     """
-    if non_lin_correction is None: # then no correction
-        return np.ones_like(frame) 
-    
+    cached = getattr(non_lin_correction, '_relgain_spline', None)
+    if cached is not None:
+        return cached
+
     # Column headers are gains, row headers are dn counts
     gain_ax = non_lin_correction.data[0, 1:]
     count_ax = non_lin_correction.data[1:, 0]
@@ -92,18 +94,218 @@ def get_relgains(frame, em_gain, non_lin_correction):
                                     kx=1,
                                     ky=1,
     )
+    non_lin_correction._relgain_spline = (count_ax, f)
+
+    return count_ax, f
+
+def build_relgain_curve(em_gain, non_lin_correction):
+    """
+    Compute the relative gain curve for a given EM gain from a non-linearity
+    correction calibration file.
+
+    This is the expensive half of the non-linearity correction: a 2d linear
+    interpolation of the calibration table at the given EM gain.  The result
+    only depends on the EM gain and the calibration file, so it is cached on
+    the calibration object and reused across frames.
+
+    Args:
+        em_gain (float): Detector EM gain.
+        non_lin_correction (corgidrp.data.NonLinearityCorrection): A NonLinearityCorrection calibration file.
+
+    Returns:
+        tuple:
+            count_ax (np.array): dn count values of the relative gain curve
+            relgain_curve (np.array): relative gain at each dn count value
+    """
+    # curves for previously requested em gains are cached on the calibration object
+    cache = getattr(non_lin_correction, '_relgain_curves', None)
+    if cache is None:
+        cache = {}
+        non_lin_correction._relgain_curves = cache
+    if em_gain in cache:
+        return cache[em_gain]
+
+    count_ax, f = _build_relgain_spline(non_lin_correction)
     # Get the relative gain curve for the given gain value
     relgain_curve = f(em_gain, count_ax)[0]
 
-    # Create interpolation for dn counts (x) and relative gains (y). For
-    # out of bounds values use edge values
-    ff = interpolate.interp1d(count_ax, relgain_curve, kind='linear',
-                              bounds_error=False,
-                              fill_value=(relgain_curve[0], relgain_curve[-1]))
-    # For each dn count, find the relative gain
-    counts_flat = ff(frame.ravel())
+    cache[em_gain] = (count_ax, relgain_curve)
+
+    return count_ax, relgain_curve
+
+def get_relgain_lut(em_gain, non_lin_correction, dn_min=0, dn_max=65535):
+    """
+    Build (or fetch from cache) a dense lookup table of relative gain values
+    at every integer dn count in [dn_min, dn_max] for a given EM gain.
+
+    The table is evaluated once per EM gain from the relative gain curve and
+    stored on the calibration object, so repeat calls skip both the
+    RectBivariateSpline and the non-uniform interpolation entirely; looking
+    up a frame reduces to an indexed gather (see get_relgains).
+
+    Args:
+        em_gain (float): Detector EM gain.
+        non_lin_correction (corgidrp.data.NonLinearityCorrection): A NonLinearityCorrection calibration file.
+        dn_min (int): Lowest dn count covered by the table. Defaults to 0.
+        dn_max (int): Highest dn count covered by the table. Defaults to 65535.
+
+    Returns:
+        tuple:
+            lut (np.array): relative gain at each integer dn count
+            dn_min (int): dn count of the first table entry
+    """
+    cache = getattr(non_lin_correction, '_relgain_luts', None)
+    if cache is None:
+        cache = {}
+        non_lin_correction._relgain_luts = cache
+    key = (em_gain, dn_min, dn_max)
+    if key in cache:
+        return cache[key]
+
+    count_ax, relgain_curve = build_relgain_curve(em_gain, non_lin_correction)
+    # evaluate the curve at every integer dn; the calibration count axis is
+    # integer-valued, so linear interpolation between adjacent table entries
+    # (done in get_relgains) reproduces the curve exactly
+    dn_ax = np.arange(dn_min, dn_max + 1, dtype=float)
+    lut = np.interp(dn_ax, count_ax, relgain_curve)
+
+    cache[key] = (lut, dn_min)
+
+    return lut, dn_min
+
+def apply_relgains(frames, count_ax, relgain_curve):
+    """
+    Look up the relative gain for each dn count value in one or more frames.
+
+    This is a 1d linear interpolation of the relative gain curve that uses
+    its edge values as constant extrapolations for out of bounds values.
+    The input can be a single frame or a batched 3-D stack of frames; the
+    whole array is interpolated in a single vectorized call.
+
+    Args:
+        frames (array_like): Array of dn count values (any shape).
+        count_ax (np.array): dn count values of the relative gain curve.
+        relgain_curve (np.array): relative gain at each dn count value.
+
+    Returns:
+        array_like: Array of relative gain values, same shape as frames.
+    """
+    # guarantee contiguity up front so the flattening below is a view
+    # rather than a copy
+    frames = np.ascontiguousarray(frames)
+    # np.interp clamps to the edge values of the curve by default, matching
+    # the edge-value extrapolation of the former interp1d call
+    counts_flat = np.interp(frames.reshape(-1), count_ax, relgain_curve)
+
+    return counts_flat.reshape(frames.shape)
+
+def get_relgains(frame, em_gain, non_lin_correction):
+    """
+    For a given bias subtracted frame of dn counts, return a same sized
+    array of relative gain values.
+
+    This algorithm contains two interpolations:
+
+    - A 2d interpolation to find the relative gain curve for a given EM gain
+      (computed once per EM gain and cached; see build_relgain_curve)
+    - A 1d interpolation to find a relative gain value for each given dn
+      count value (see apply_relgains).
+
+    Both of these interpolations are linear, and both use their edge values as
+    constant extrapolations for out of bounds values.
+
+    Parameters:
+        frame (array_like): Array of dn count values.
+        em_gain (float): Detector EM gain.
+        non_lin_correction (corgi.drp.NonLinearityCorrection): A NonLinearityCorrection calibration file.
 
-    return counts_flat.reshape(frame.shape)
+    Returns:
+        array_like: Array of relative gain values.
+    """
+    return relgain_interpolator(em_gain, non_lin_correction)(frame)
+
+def relgain_interpolator(em_gain, non_lin_correction):
+    """
+    Return a function specialized to look up relative gains at a fixed EM
+    gain.
+
+    The dense lookup table for the given EM gain is bound into the returned
+    closure, so call sites that stream many frames at one gain pay the table
+    construction and cache lookups once and the per-frame work reduces to
+    the indexed gather.
+
+    Args:
+        em_gain (float): Detector EM gain.
+        non_lin_correction (corgidrp.data.NonLinearityCorrection): A NonLinearityCorrection calibration file.
+
+    Returns:
+        callable: function mapping an array of dn count values to an array of
+        relative gain values of the same shape.
+    """
+    if non_lin_correction is None: # then no correction
+        def unity(frame):
+            return np.ones_like(frame)
+        return unity
+
+    lut, dn_min = get_relgain_lut(em_gain, non_lin_correction)
+    last = lut.size - 1
+
+    def interpolator(frame):
+        # guarantee contiguity so the flattening below is a view, not a copy
+        frame = np.ascontiguousarray(frame)
+        # index into the dense table; a linear blend between the two
+        # neighboring integer entries handles fractional dn values, and
+        # clipping reproduces the edge-value extrapolation of the curve
+        pos = np.clip(frame.reshape(-1) - dn_min, 0, last)
+        ind = pos.astype(int)
+        frac = pos - ind
+        counts_flat = lut[ind] * (1. - frac) + lut[np.minimum(ind + 1, last)] * frac
+        return counts_flat.reshape(frame.shape)
+
+    return interpolator
+
+def get_relgains_batch(frames, em_gains, non_lin_correction):
+    """
+    For a stack of bias subtracted frames of dn counts, each with its own EM
+    gain, return a same sized stack of relative gain values.
+
+    The relative gain curves for all distinct EM gains are evaluated from the
+    2d interpolation in a single batched call rather than once per frame;
+    frames sharing an EM gain share the cached curve (see get_relgains).
+
+    Args:
+        frames (array_like): Stack of dn count frames, shape (N, rows, cols).
+        em_gains (array_like): Detector EM gain of each frame, length N.
+        non_lin_correction (corgidrp.data.NonLinearityCorrection): A NonLinearityCorrection calibration file.
+
+    Returns:
+        array_like: Stack of relative gain values, same shape as frames.
+    """
+    frames = np.asarray(frames)
+    if non_lin_correction is None: # then no correction
+        return np.ones_like(frames)
+
+    em_gains = np.asarray(em_gains, dtype=float)
+    if em_gains.shape != (frames.shape[0],):
+        raise ValueError('em_gains must provide one EM gain per frame')
+
+    cache = getattr(non_lin_correction, '_relgain_curves', None)
+    if cache is None:
+        cache = {}
+        non_lin_correction._relgain_curves = cache
+    new_gains = [gain for gain in np.unique(em_gains) if gain not in cache]
+    if new_gains:
+        count_ax, f = _build_relgain_spline(non_lin_correction)
+        # one spline evaluation for all new em gains at once
+        curves = f(new_gains, count_ax)
+        for gain, curve in zip(new_gains, curves):
+            cache[gain] = (count_ax, curve)
+
+    relgains = np.empty(frames.shape, dtype=float)
+    for i in range(frames.shape[0]):
+        relgains[i] = get_relgains(frames[i], em_gains[i], non_lin_correction)
+
+    return relgains
 
 detector_areas= {
     'SCI' : {
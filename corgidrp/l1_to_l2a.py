@@ -1,5 +1,5 @@
 # A file that holds the functions that transmogrify l1 data to l2a data
-from corgidrp.detector import get_relgains, slice_section, detector_areas, flag_cosmics, calc_sat_fwc, imaging_slice, imaging_area_geom
+from corgidrp.detector import get_relgains_batch, slice_section, detector_areas, flag_cosmics, calc_sat_fwc, imaging_slice, imaging_area_geom
 import numpy as np
 import corgidrp.data as data
 
@@ -302,6 +302,7 @@ def correct_nonlinearity(input_dataset, non_lin_correction):
     if "CMDGAIN" not in linearized_dataset[0].ext_hdr.keys():
         raise ValueError("EM gain not found in header of input dataset. Non-linearity correction requires EM gain to be in header.")
 
+    em_gains = []
     for i in range(linearized_cube.shape[0]):
         try: # use measured gain if available TODO change hdr name if necessary
             em_gain = linearized_dataset[i].ext_hdr["EMGAIN_M"]
@@ -310,7 +311,10 @@ def correct_nonlinearity(input_dataset, non_lin_correction):
                 em_gain = linearized_dataset[i].ext_hdr["EMGAIN_A"]
             except: # otherwise use commanded EM gain
                 em_gain = linearized_dataset[i].ext_hdr["CMDGAIN"]
-        linearized_cube[i] *= get_relgains(linearized_cube[i], em_gain, non_lin_correction)
+        em_gains.append(em_gain)
+    # the relative gain curves for all the distinct EM gains in the dataset
+    # are evaluated in one batched call
+    linearized_cube *= get_relgains_batch(linearized_cube, em_gains, non_lin_correction)
     
     if non_lin_correction is not None:
         history_msg = "Data corrected for non-linearity with {0}".format(non_lin_correction.filename)
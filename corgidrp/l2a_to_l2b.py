@@ -1,6 +1,7 @@
 # A file that holds the functions that transmogrify l2a data to l2b data
 import numpy as np
 import copy
+from scipy.linalg import toeplitz
 import corgidrp.data as data
 from corgidrp.darks import build_synthesized_dark
 from corgidrp.detector import detector_areas
@@ -93,7 +94,10 @@ def dark_subtraction(input_dataset, dark, detector_regions=None, outputdir=None)
     else:
         raise Exception('dark type should be either corgidrp.data.Dark or corgidrp.data.DetectorNoiseMaps.')
 
-    darksub_cube = darksub_dataset.all_data - dark.data
+    # subtract in place on the copy (dark.data broadcasts across the stack)
+    # instead of allocating a second cube
+    darksub_cube = np.subtract(darksub_dataset.all_data, dark.data,
+                               out=darksub_dataset.all_data)
 
     # propagate the error of the dark frame
     if hasattr(dark, "err"):
@@ -301,8 +305,10 @@ def em_gain_division(input_dataset):
                 emgain = emgain_dataset[i].ext_hdr["EMGAIN_A"]
             except: # otherwise use commanded EM gain
                 emgain = emgain_dataset[i].ext_hdr["CMDGAIN"]
-        emgain_cube[i] /= emgain
-        emgain_error[i] /= emgain
+        # multiply by the reciprocal; one scalar divide instead of one per pixel
+        inv_emgain = 1./emgain
+        emgain_cube[i] *= inv_emgain
+        emgain_error[i] *= inv_emgain
 
     dataset_list, _ = emgain_dataset.split_dataset(exthdr_keywords=['CMDGAIN'])
     if len(dataset_list) > 1:
@@ -397,14 +403,16 @@ def desmear(input_dataset, detector_params):
 
     for i in range(data_cube.shape[0]):
         exptime_sec = float(data[i].ext_hdr['EXPTIME'])
-        smear = np.zeros_like(data_cube[i])
-        m = len(smear)
-        for r in range(m):
-            columnsum = 0
-            for s in range(r+1):
-                columnsum = columnsum + rowreadtime_sec/exptime_sec*((1
-                + rowreadtime_sec/exptime_sec)**((s+1)-(r+1)-1))*data_cube[i,s,:]
-            smear[r,:] = columnsum
+        ratio = rowreadtime_sec/exptime_sec
+        m = data_cube.shape[1]
+        # the smear contribution of row s to row r only depends on the row
+        # separation r-s, so hoist the invariant weights out of the row loop:
+        # smear[r] = sum_{s<=r} ratio*(1+ratio)**(s-r-1) * data[s]
+        weights = ratio*(1. + ratio)**(-np.arange(1, m + 1, dtype=float))
+        # apply the lower-triangular Toeplitz kernel to all columns with a
+        # single matrix product instead of the former O(rows^2) Python loop
+        kernel = toeplitz(weights, np.zeros(m))
+        smear = kernel @ data_cube[i]
         data_cube[i] -= smear
 
     history_msg = "Desmear applied to data"
@@ -2,9 +2,12 @@
 count array with photometric corrections.
 
 """
+import math
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from astropy.io import fits
+import corgidrp
 import corgidrp.data as data
 
 def varL23(g, L, T, N):
@@ -21,15 +24,28 @@ def varL23(g, L, T, N):
         (float): variance from photon counting and the photometric correction
 
     '''
-    Const = 6/(6 + L*(6 + L*(3 + L)))
-    eThresh = (Const*(np.e**(-T/g)*L*(2*g**2*(6 + L*(3 + L)) +
-            2*g*L*(3 + L)*T + L**2*T**2))/(12*g**2))
-    std_dev = np.sqrt(N * eThresh * (1-eThresh))
-
-    return (std_dev)**2*(((np.e**((T/g)))/N) +
-    2*((np.e**((2*T)/g)*(g - T))/(2*g*N**2))*(N*eThresh) +
-    3*(((np.e**(((3*T)/g)))*(4*g**2 - 8*g*T + 5*T**2))/(
-    12*g**2*N**3))*(N*eThresh)**2)**2
+    # the exponentials and powers of the gain only involve scalars, so
+    # evaluate them once up front
+    eTg = math.exp(T/g)
+    e2Tg = eTg*eTg
+    e3Tg = e2Tg*eTg
+    g2 = g**2
+    # Horner forms of the cubic in L shared by the numerator and
+    # denominator; poly3 folds poly2 in as its inner factor, and the linear
+    # factor (3 + L) feeds both poly2 and the cross term
+    L3 = 3 + L
+    poly2 = 6 + L*L3
+    poly3 = 6 + L*poly2
+    eThresh = (math.exp(-T/g)*L*(2*g2*poly2 +
+            2*g*L*L3*T + L**2*T**2))/(2*g2*poly3)
+    NeThresh = N*eThresh
+    # variance of the photon-counted sum, i.e. (std_dev)**2
+    var_sum = NeThresh*(1 - eThresh)
+
+    return var_sum*((eTg/N) +
+    ((e2Tg*(g - T))/(g*N**2))*NeThresh +
+    ((e3Tg*(4*g2 - 8*g*T + 5*T**2))/(
+    4*g2*N**3))*NeThresh**2)**2
 
 class PhotonCountException(Exception):
     """Exception class for photon_count module."""
@@ -44,20 +60,59 @@ def photon_count(e_image, thresh):
             values <= thresh will be assigned a 0.
 
     Returns:
-        pc_image (array_like, float): Output digital image in units of photons.
+        pc_image (array_like, bool): Output digital image in units of photons.
 
     B Nemati and S Miller - UAH - 06-Aug-2018
 
     """
-    # Check if input is an array/castable to one
-    e_image = np.array(e_image).astype(float)
-    if len(e_image.shape) == 0:
+    # Check if input is an array/castable to one; no copy needed since the
+    # comparison below doesn't modify the input
+    e_image = np.asarray(e_image)
+    if e_image.ndim == 0:
         raise PhotonCountException('e_image must have length > 0')
 
-    pc_image = np.zeros(e_image.shape, dtype=int)
-    pc_image[e_image > thresh] = 1
+    # the comparison itself is the photon-counted image; bool (1 byte/pixel)
+    # behaves as 0/1 in any downstream arithmetic
+    return e_image > thresh
+
+
+def _coadd_pc(all_data, all_err0, all_dq, thresh):
+    """Photon count and co-add a stack of frames in one streaming pass.
+
+    Accumulates the per-pixel unmasked-frame count and the three co-added
+    photon-counted frames (nominal, +err, -err) while iterating over the
+    stack frame by frame, so the stack is read once and no frame-stack-sized
+    boolean temporaries are materialized.
+
+    Args:
+        all_data (array-like): (N, rows, cols) stack of frames (e-).
+        all_err0 (array-like): (N, rows, cols) stack of frame errors (e-).
+        all_dq (array-like): (N, rows, cols) stack of DQ maps.
+        thresh (float): Photon-counting threshold (e-).
+
+    Returns:
+        tuple:
+            nframes (array-like): number of unmasked frames per pixel.
+            coadd (array-like): co-added photon-counted frame.
+            coadd_up (array-like): co-added photon-counted frame of data + err.
+            coadd_low (array-like): co-added photon-counted frame of data - err.
 
-    return pc_image
+    """
+    shape = all_data.shape[1:]
+    nframes = np.zeros(shape, dtype=float)
+    coadd = np.zeros(shape, dtype=float)
+    coadd_up = np.zeros(shape, dtype=float)
+    coadd_low = np.zeros(shape, dtype=float)
+    for i in range(all_data.shape[0]):
+        d = all_data[i]
+        e = all_err0[i]
+        good = (all_dq[i] == 0)
+        nframes += good
+        coadd += (d > thresh) & good
+        coadd_up += (d + e > thresh) & good
+        coadd_low += (d - e > thresh) & good
+
+    return nframes, coadd, coadd_up, coadd_low
 
 
 def get_pc_mean(input_dataset, pc_master_dark=None, T_factor=None, pc_ecount_max=None, niter=2, mask_filepath=None, safemode=True, inputmode='illuminated'):
@@ -153,15 +208,16 @@ def get_pc_mean(input_dataset, pc_master_dark=None, T_factor=None, pc_ecount_max
     pc_means = []
     errs = []
     dqs = []
-    # getting number of read noise standard deviations at which to set the
-    # photon-counting threshold
-    if T_factor is None:
+    if T_factor is None or pc_ecount_max is None:
+        # only need to construct the default detector params once for both
         detector_params = data.DetectorParams({})
-        T_factor = detector_params.params['T_factor']
-    # getting maximum allowed electrons/pixel/frame for photon counting
-    if pc_ecount_max is None:
-        detector_params = data.DetectorParams({})
-        pc_ecount_max = detector_params.params['pc_ecount_max']
+        # getting number of read noise standard deviations at which to set
+        # the photon-counting threshold
+        if T_factor is None:
+            T_factor = detector_params.params['T_factor']
+        # getting maximum allowed electrons/pixel/frame for photon counting
+        if pc_ecount_max is None:
+            pc_ecount_max = detector_params.params['pc_ecount_max']
     if mask_filepath is None:
         mask = np.zeros_like(dataset.frames[0].data)
     else:
@@ -175,12 +231,11 @@ def get_pc_mean(input_dataset, pc_master_dark=None, T_factor=None, pc_ecount_max
     if thresh < 0:
         raise PhotonCountException('thresh must be nonnegative')
     
-    if 'EMGAIN_M' in dataset.frames[0].ext_hdr: # if EM gain measured directly from frame TODO change hdr name if necessary
-        em_gain = dataset.frames[0].ext_hdr['EMGAIN_M']
-    elif 'EMGAIN_A' in dataset.frames[0].ext_hdr: # use applied EM gain if available
-        em_gain = dataset.frames[0].ext_hdr['EMGAIN_A']
-    elif 'CMDGAIN' in dataset.frames[0].ext_hdr: # use commanded gain otherwise
-        em_gain = dataset.frames[0].ext_hdr['CMDGAIN']
+    # prefer EM gain measured directly from frame, then applied EM gain,
+    # then commanded gain; one header binding and a get chain instead of
+    # repeated containment tests TODO change hdr name if necessary
+    hdr = dataset.frames[0].ext_hdr
+    em_gain = hdr.get('EMGAIN_M', hdr.get('EMGAIN_A', hdr.get('CMDGAIN')))
 
     if thresh >= em_gain:
         if safemode:
@@ -205,33 +260,31 @@ def get_pc_mean(input_dataset, pc_master_dark=None, T_factor=None, pc_ecount_max
         warnings.warn('thresh should be at least 4 or 5 times read_noise for '
         'accurate photon counting')
 
-    # Photon count stack of frames
-    frames_pc = photon_count(dataset.all_data, thresh)
-    bool_map = dataset.all_dq.astype(bool).astype(float)
-    bool_map[bool_map > 0] = np.nan
-    bool_map[bool_map == 0] = 1
-    nframes = np.nansum(bool_map, axis=0)
-    # upper and lower bounds for PC (for getting accurate err)
-    frames_pc_up = photon_count(dataset.all_data+dataset.all_err[:,0], thresh)
-    frames_pc_low = photon_count(dataset.all_data-dataset.all_err[:,0], thresh)
-    frames_pc_masked = frames_pc * bool_map
-    frames_pc_masked_up = frames_pc_up * bool_map
-    frames_pc_masked_low = frames_pc_low * bool_map
-    # Co-add frames
-    frame_pc_coadded = np.nansum(frames_pc_masked, axis=0)
-    frame_pc_coadded_up = np.nansum(frames_pc_masked_up, axis=0)
-    frame_pc_coadded_low = np.nansum(frames_pc_masked_low, axis=0)
+    # Photon count and co-add the stack of frames, counting only unmasked
+    # pixels; the nominal, +err, and -err co-adds and the per-pixel
+    # unmasked-frame count all come out of one streaming pass over the stack
+    # slice the per-pixel error plane out of the 4-D error cube once; the
+    # contiguous copy keeps the +err/-err comparisons streaming over a
+    # contiguous buffer instead of a strided view
+    stack = dataset.all_data
+    err0 = np.ascontiguousarray(dataset.all_err[:,0])
+    if corgidrp.pc_stack_float32:
+        # opt-in: threshold in single precision to halve the memory traffic
+        # of the co-add pass; electron counts fit comfortably in float32.
+        # The downstream photometric correction stays in double precision.
+        stack = stack.astype(np.float32)
+        err0 = err0.astype(np.float32)
+    nframes, frame_pc_coadded, frame_pc_coadded_up, frame_pc_coadded_low = \
+        _coadd_pc(stack, err0, dataset.all_dq, thresh)
     
     # Correct for thresholding and coincidence loss; any pixel masked all the 
     # way through the stack may give NaN, but it should be masked in lam_newton_fit(); 
     # and it doesn't matter anyways since its DQ value will be 1 (it will be masked when the 
     # bad pixel correction is run, which comes after this photon-counting step)
-    mean_expected = corr_photon_count(frame_pc_coadded, nframes, thresh,
-                                        em_gain, considered_indices, niter)
-    mean_expected_up = corr_photon_count(frame_pc_coadded_up, nframes, thresh,
-                                        em_gain, considered_indices, niter)
-    mean_expected_low = corr_photon_count(frame_pc_coadded_low, nframes, thresh,
-                                        em_gain, considered_indices, niter)
+    mean_expected, mean_expected_up, mean_expected_low = \
+        _corr_photon_count_batch(
+            (frame_pc_coadded, frame_pc_coadded_up, frame_pc_coadded_low),
+            nframes, thresh, em_gain, considered_indices, niter)
     ##### error calculation: accounts for err coming from input dataset and 
     # statistical error from the photon-counting and photometric correction process. 
     # expected error from photon counting (biggest source from the actual values, not 
@@ -240,7 +293,8 @@ def get_pc_mean(input_dataset, pc_master_dark=None, T_factor=None, pc_ecount_max
     up = mean_expected_up +  pc_variance
     low = mean_expected_low -  pc_variance
     errs.append(np.max([up - mean_expected, mean_expected - low], axis=0))
-    dq = (nframes == 0).astype(int) 
+    # uint8 is plenty for a 0/1 flag map and keeps the combine below cheap
+    dq = (nframes == 0).astype(np.uint8)
     pc_means.append(mean_expected)
     dqs.append(dq)
     
@@ -263,16 +317,16 @@ def get_pc_mean(input_dataset, pc_master_dark=None, T_factor=None, pc_ecount_max
         filename_end = ''
     else:
         pc_means.append(np.zeros_like(pc_means[0]))
-        dqs.append(np.zeros_like(pc_means[0]).astype(int))
+        dqs.append(np.zeros(pc_means[0].shape, dtype=np.uint8))
         errs.append(np.zeros_like(pc_means[0]))
         dark_sub = "no"
         filename_end = '_no_ds'
 
     # now subtract the dark PC mean
     combined_pc_mean = pc_means[0] - pc_means[1]
-    combined_pc_mean[combined_pc_mean<0] = 0
+    np.maximum(combined_pc_mean, 0, out=combined_pc_mean)
     combined_err = np.sqrt(errs[0]**2 + errs[1]**2)
-    combined_dq = np.bitwise_or(dqs[0], dqs[1])
+    combined_dq = dqs[0] | dqs[1]
     pri_hdr = dataset[0].pri_hdr.copy()
     ext_hdr = dataset[0].ext_hdr.copy()
     err_hdr = dataset[0].err_hdr.copy()
@@ -321,6 +375,57 @@ def corr_photon_count(nobs, nfr, t, g, mask_indices, niter=2):
     return lam
 
 
+def _corr_photon_count_batch(coadds, nfr, t, g, mask_indices, niter=2):
+    """Correct several photon-counted co-adds that share nfr, t, and g.
+
+    The nominal, +err, and -err co-adds in get_pc_mean go through the same
+    correction with identical frame counts, threshold, and gain, so the
+    scalar exponential and the per-pixel reciprocal of nfr are computed once
+    here and reused, instead of once per corr_photon_count call.
+
+    Args:
+        coadds (iterable of array_like): Co-added photon-counted frames.
+        nfr (array_like): Number of coadded frames per pixel.
+        t (float): Photon-counting threshold.
+        g (float): EM gain.
+        mask_indices (array-like): indices of pixel positions to use.
+        niter (int, optional): Number of Newton's method iterations. Defaults to 2.
+
+    Returns:
+        list: Mean expected electrons per pixel (lambda) for each co-add.
+
+    """
+    exp_t_g = math.exp(t / g)
+    inv_nfr = 1. / nfr
+
+    def _correct(nobs):
+        """Run the lambda first guess and Newton fit for one co-add.
+
+        Args:
+            nobs (array_like): Co-added photon-counted frame.
+
+        Returns:
+            lam (array_like): Mean expected electrons per pixel (lambda).
+
+        """
+        # same first-order/zeroth-order select as calc_lam_approx, with the
+        # shared factors hoisted
+        lam0 = nobs * inv_nfr
+        init = 1 - lam0 * exp_t_g
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lam1 = np.where(init > 0, -np.log(np.maximum(init, 1e-300)),
+                            lam0)
+        return lam_newton_fit(nobs, nfr, t, g, lam1, niter, mask_indices)
+
+    # the corrections are independent and spend their time in NumPy kernels
+    # that release the GIL, so run them in parallel threads
+    coadds = list(coadds)
+    with ThreadPoolExecutor(max_workers=len(coadds)) as pool:
+        lams = list(pool.map(_correct, coadds))
+
+    return lams
+
+
 def calc_lam_approx(nobs, nfr, t, g):
     """Approximate lambda calculation.
 
@@ -340,17 +445,16 @@ def calc_lam_approx(nobs, nfr, t, g):
     """
     # First step of equation (before taking log)
     init = 1 - (nobs/nfr) * np.exp(t/g)
-    # Mask out all values less than or equal to 0
-    lam_m = np.zeros_like(init).astype(bool)
-    lam_m[init > 0] = True
-
-    # Use the first order approximation on all values greater than zero
-    lam1 = np.zeros_like(init)
-    lam1[lam_m] = -np.log(init[lam_m])
-
-    # For any values less than zero, revert to the zeroth order approximation
+    # Zeroth order approximation
     lam0 = nobs / nfr
-    lam1[~lam_m] = lam0[~lam_m]
+
+    # Use the first order approximation on all values greater than zero and
+    # revert to the zeroth order elsewhere; a single streaming select
+    # replaces the former boolean gather/scatter passes. The clip keeps log
+    # off non-positive values, and those lanes are discarded by the select
+    # anyway, so errstate just silences complaints about them.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lam1 = np.where(init > 0, -np.log(np.maximum(init, 1e-300)), lam0)
 
     return lam1
 
@@ -371,28 +475,60 @@ def lam_newton_fit(nobs, nfr, t, g, lam0, niter, mask_indices):
         lam (array_like): Mean expected (lambda).
 
     """
-    # Mask out zero values to avoid divide by zero
-    lam_est_m = np.ma.masked_array(lam0, mask=(lam0==0))
-    nobs_m = np.ma.masked_array(nobs, mask=(nobs==0))
-
-    # Iterate Newton's method
-    for i in range(niter):
-        func = _calc_func(nobs_m, nfr, t, g, lam_est_m)
-        dfunc = _calc_dfunc(nfr, t, g, lam_est_m)
-        lam_est_m -= func / dfunc
-
-    if np.nanmin(lam_est_m.data[mask_indices]) < 0:
+    # Only pixels with a nonzero first guess and nonzero counts take Newton
+    # steps; everything else keeps a lambda of 0.  This avoids the divide by
+    # zero the former masked arrays guarded against, and iterating on the
+    # compacted active set keeps every per-iteration temporary the size of
+    # the active pixel count instead of the full image.
+    lam0 = np.asarray(lam0, dtype=float)
+    active = (lam0 != 0) & (nobs != 0)
+    lam_act = lam0[active]
+    nobs_act = nobs[active]
+    nfr_act = np.broadcast_to(nfr, lam0.shape)[active]
+
+    # Iterate Newton's method tile by tile: each tile's intermediates fit in
+    # cache, so a pixel's Newton state stays resident through all niter
+    # iterations instead of round-tripping through memory between them.
+    # When no pixel is active or no iterations are requested, skip straight
+    # to the sanity check on the first guess.
+    if niter > 0 and lam_act.size > 0:
+        tile = 65536
+        for start in range(0, lam_act.size, tile):
+            sl = slice(start, start + tile)
+            lam_tile = lam_act[sl]
+            nobs_tile = nobs_act[sl]
+            nfr_tile = nfr_act[sl]
+            for i in range(niter):
+                func, dfunc = _calc_func_dfunc(nobs_tile, nfr_tile, t, g,
+                                               lam_tile)
+                lam_tile -= func / dfunc
+
+    # inactive pixels keep their initial guess for the sanity check below,
+    # as they did under the former masked arrays
+    lam_data = lam0.copy()
+    lam_data[active] = lam_act
+    # nanmin, not min: pixels masked through the whole stack carry NaN
+    # first guesses, and a plain min would let them poison the comparison
+    # and hide a genuinely negative lambda elsewhere
+    if np.nanmin(lam_data[mask_indices]) < 0:
         raise PhotonCountException('negative number of photon counts; '
         'try decreasing the frametime')
 
     # Fill zero values back in
-    lam = lam_est_m.filled(0)
+    lam = np.zeros_like(lam0)
+    lam[active] = lam_act
 
     return lam
 
-def _calc_func(nobs, nfr, t, g, lam):
-    """Objective function for lambda for Newton's method for all applying photometric correction.
-    
+def _calc_func_dfunc(nobs, nfr, t, g, lam):
+    """Objective function for lambda for Newton's method for applying the
+    photometric correction, together with its derivative with respect to
+    lambda.
+
+    The two share most of their sub-expressions (the Horner-form cubics in
+    lambda and the common denominator), so computing them together halves
+    the arithmetic per Newton iteration compared with two separate calls.
+
     Args:
         nobs (array-like): number of frames per pixel that passed the threshold
         nfr (array-like): number of unmasked frames per pixel total
@@ -401,11 +537,17 @@ def _calc_func(nobs, nfr, t, g, lam):
         lam (array-like): estimated mean expected electron count
 
     Returns:
-        func (array-like): objective function
+        tuple:
+            func (array-like): objective function
+            dfunc (array-like): derivative with respect to lambda of objective function
 
     """
-    epsilon_prime = (lam*(2*g**2*(6 + lam*(3 + lam)) + 2*g*lam*(3 + lam)*t + 
-            lam**2*t**2))/(2.*np.e**(t/g)*g**2*(6 + lam*(6 + lam*(3 + lam))))
+    poly2 = 6 + lam*(3 + lam)
+    poly3 = 6 + lam*(6 + lam*(3 + lam))
+    denom = 2.*math.exp(t/g)*g**2*poly3
+    inner = 2*g**2*poly2 + 2*g*lam*(3 + lam)*t + lam**2*t**2
+
+    epsilon_prime = lam*inner/denom
 
     #if (nfr * epsilon_prime).any() > nobs.any():
     #    warnings.warn('Input photon flux is too high; decrease frametime')
@@ -413,26 +555,8 @@ def _calc_func(nobs, nfr, t, g, lam):
     # close enough to 0 for Newton's method
     func = nfr * epsilon_prime - nobs
 
-    return func
-
+    dfunc = (lam*nfr*(2*g**2*(3 + 2*lam) + 2*g*lam*t + 2*g*(3 + lam)*t +
+            2*lam*t**2) + nfr*inner)/denom - \
+            (poly2 + lam*(3 + 2*lam))*nfr*lam*inner/(denom*poly3)
 
-def _calc_dfunc(nfr, t, g, lam):
-    """Derivative with respect to lambda of objective function.
-    
-    Args:
-        nfr (array-like): number of unmasked frames per pixel total
-        t (float): threshold for photon counting
-        g (float): EM gain
-        lam (array-like): estimated mean expected electron count
-    
-    Returns:
-        dfunc (array-like): derivative with respect to lambda of objective function
-    """
-    dfunc = (lam*nfr*(2*g**2*(3 + 2*lam) + 2*g*lam*t + 2*g*(3 + lam)*t + 
-            2*lam*t**2))/(2.*np.e**(t/g)*g**2*(6 + lam*(6 + lam*(3 + lam)))) - (lam*(6 + 
-            lam*(3 + lam) + lam*(3 + 2*lam))*nfr*
-         (2*g**2*(6 + lam*(3 + lam)) + 2*g*lam*(3 + lam)*t + lam**2*t**2))/(2.*np.e**(t/g)*g**2*(6 + 
-        lam*(6 + lam*(3 + lam)))**2) + (nfr*(2*g**2*(6 + lam*(3 + lam)) + 2*g*lam*(3 + lam)*t + 
-        lam**2*t**2))/(2.*np.e**(t/g)*g**2*(6 + lam*(6 + lam*(3 + lam))))
-
-    return dfunc
\ No newline at end of file
+    return func, dfunc
\ No newline at end of file
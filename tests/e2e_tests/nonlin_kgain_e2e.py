@@ -29,12 +29,9 @@ def set_vistype_for_tvac(
     """
     print("Adding VISTYPE='PUPILIMG' to TVAC data")
     for file in list_of_fits:
-        fits_file = fits.open(file)
-        prihdr = fits_file[0].header
-        # Adjust VISTYPE
-        prihdr['VISTYPE'] = 'PUPILIMG'
-        # Update FITS file
-        fits_file.writeto(file, overwrite=True)
+        # update the keyword in place; fits.setval rewrites only the header
+        # block instead of the whole (multi-MB) file
+        fits.setval(file, 'VISTYPE', value='PUPILIMG', ext=0)
 
 
 @pytest.mark.e2e
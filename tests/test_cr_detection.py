@@ -388,7 +388,9 @@ def test_iit_vs_corgidrp():
                                           cosm_tail, mode)
     corgi_crmask_bool = np.where(crmasked_dataset.all_dq>0,1,0)
 
-    if not corgi_crmask_bool == approx(iit_masks_arr):
+    # np.allclose runs the whole comparison in C; pytest.approx walks
+    # mismatching full-frame arrays element by element in Python
+    if not np.allclose(corgi_crmask_bool, iit_masks_arr):
         raise Exception(f'Corgidrp and II&T functions do not result in the same CR masks.')
 
 def test_crs_zeros_frame():
@@ -405,7 +407,7 @@ def test_crs_zeros_frame():
 
     output_dataset = detect_cosmic_rays(dataset, detector_params)
 
-    if output_dataset.all_dq != approx(0,abs=tol):
+    if not np.allclose(output_dataset.all_dq, 0, atol=tol):
         raise Exception(f'Operating on all zero frames did not return all zero dq mask.')
 
 def test_correct_headers():
@@ -529,7 +531,7 @@ def test_mask():
     c_tail = 6
     check_mask[0,1, 2:2+cosm_filter+c_tail+1] = 1 #add 1 to include last column in the slice
     dataset_masked = detect_cosmic_rays(dataset, detector_params, k_gain, sat_thresh, plat_thresh, cosm_filter, cosm_box=0, cosm_tail=c_tail)
-    if not np.where(dataset_masked.all_dq>0,1,0) == approx(check_mask):
+    if not np.allclose(np.where(dataset_masked.all_dq>0,1,0), check_mask):
         raise Exception("Incorrect pixels were masked.")
 
 def test_mask_box():
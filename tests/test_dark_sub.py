@@ -158,5 +158,77 @@ def test_dark_sub():
 
     corgidrp.track_individual_errors = old_err_tracking
 
+def test_trad_dark_median():
+    """
+    Check the median collapse of build_trad_dark: the combined data is the
+    masked median of the stack, the statistical error carries the sqrt(pi/2)
+    inflation relative to the mean, and masked pixels get the same dq flags
+    as the mean path.
+    """
+    dark_dataset = mocks.create_dark_calib_files(filedir=None, numfiles=4)
+
+    # only mean and median are valid collapse choices
+    with pytest.raises(ValueError):
+        build_trad_dark(dark_dataset, detector_params, full_frame=True,
+                        collapse='sum')
+
+    ds = dark_dataset.copy()
+    # tag as bad pixel all the
+    # way through for one pixel (7,8)
+    # And mask (10,12) to get flag value of 256
+    ds.all_dq[:,7,8] = 4
+    ds.all_dq[:int(1+len(ds)/2),10,12] = 2
+
+    with pytest.warns(UserWarning):
+        master_dark = build_trad_dark(ds, detector_params, full_frame=True,
+                                      collapse='median')
+    assert master_dark.dq[7,8] == 1
+    assert master_dark.dq[10,12] == 256
+
+    # build_trad_dark zeroes the telemetry rows, so do the same before
+    # comparing
+    telem_rows = slice(detector_params.params['telem_rows_start'],
+                       detector_params.params['telem_rows_end'])
+    stack = ds.all_data.copy()
+    stack[:, telem_rows, :] = 0
+    masked_stack = np.ma.masked_array(stack, ds.all_dq.astype(bool))
+
+    expected = np.ma.filled(np.ma.median(masked_stack, axis=0), 0)
+    assert np.array_equal(master_dark.data, expected)
+    # pixel masked through the whole stack gets filled with 0
+    assert master_dark.data[7,8] == 0
+
+    # the mock frames carry zero err, so the combined error is the
+    # statistical error alone, inflated by sqrt(pi/2) for the median
+    unmasked_num = (~masked_stack.mask).sum(axis=0)
+    good = unmasked_num > 0
+    expected_err = np.ma.getdata(np.ma.std(masked_stack, axis=0))[good] \
+        / np.sqrt(unmasked_num[good]) * np.sqrt(np.pi/2)
+    assert np.array_equal(master_dark.err[0][good], expected_err)
+
+def test_dark_combine_float32():
+    """
+    Check that building a traditional dark with corgidrp.dark_combine_float32
+    set agrees with the default float64 combination to within float32
+    precision and produces identical dq flags.
+    """
+    old_float32 = corgidrp.dark_combine_float32
+
+    dark_dataset = mocks.create_dark_calib_files(filedir=None, numfiles=4)
+
+    corgidrp.dark_combine_float32 = False
+    dark64 = build_trad_dark(dark_dataset, detector_params, full_frame=True)
+    corgidrp.dark_combine_float32 = True
+    dark32 = build_trad_dark(dark_dataset, detector_params, full_frame=True)
+
+    corgidrp.dark_combine_float32 = old_float32
+
+    assert dark32.data.dtype == np.float32
+    assert np.allclose(dark32.data, dark64.data, rtol=1e-5, atol=1e-2)
+    assert np.allclose(dark32.err, dark64.err, rtol=1e-3, atol=1e-2)
+    assert np.array_equal(dark32.dq, dark64.dq)
+
 if __name__ == "__main__":
     test_dark_sub()
+    test_trad_dark_median()
+    test_dark_combine_float32()
@@ -157,8 +157,37 @@ def test_pc():
     with pytest.raises(PhotonCountException):
         get_pc_mean(dark_dataset_err, inputmode='illuminated')
 
+def test_pc_stack_float32():
+    '''
+    Tests that photon-counting with corgidrp.pc_stack_float32 set agrees with
+    the default float64 thresholding to within float32 precision and produces
+    identical dq flags.
+    '''
+    old_float32 = corgidrp.pc_stack_float32
+    np.random.seed(789)
+    dataset, _, _, _ = mocks.create_photon_countable_frames(Nbrights=15, Ndarks=1, cosmic_rate=0, full_frame=False, smear=False)
+    # same simple pre-processing as in test_pc()
+    for f in dataset.frames:
+        f.data = f.data.astype(float)*7 - 20000.
+    dataset.all_data = dataset.all_data.astype(float)*7 - 20000.
+    for f in dataset.frames:
+        f.ext_hdr['RN'] = 100
+        f.ext_hdr['KGAIN'] = 7
+
+    corgidrp.pc_stack_float32 = False
+    pc64 = get_pc_mean(dataset)
+    corgidrp.pc_stack_float32 = True
+    pc32 = get_pc_mean(dataset)
+
+    corgidrp.pc_stack_float32 = old_float32
+
+    assert np.allclose(pc32.all_data, pc64.all_data, rtol=1e-4, atol=1e-6, equal_nan=True)
+    assert np.allclose(pc32.all_err, pc64.all_err, rtol=1e-4, atol=1e-6, equal_nan=True)
+    assert np.array_equal(pc32.all_dq, pc64.all_dq)
+
 if __name__ == '__main__':
     test_pc()
     test_negative()
+    test_pc_stack_float32()
     
     
\ No newline at end of file